@@ -1,89 +1,399 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from geopy.geocoders import Nominatim, GoogleV3
 from geopy.exc import GeocoderTimedOut
+from geopy.extra.rate_limiter import RateLimiter
 import pandas as pd
+from pandas.api.types import is_bool_dtype, is_object_dtype, is_string_dtype
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from contextlib import closing
+import functools
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
 import time
 import re
+import unicodedata
 import pycountry
+from typing import NamedTuple
+
+# Number of addresses geocoded at once. Google allows parallel requests,
+# Nominatim's usage policy asks for at most one request per second.
+GOOGLE_CONCURRENCY = 10
+NOMINATIM_CONCURRENCY = 1
+
+# Minimum delay between requests to each provider. Nominatim's usage policy
+# allows one request per second, Google accepts far more.
+NOMINATIM_MIN_DELAY = 1.0
+GOOGLE_MIN_DELAY = 0.02
+
+# Seconds to wait for a provider response (geopy defaults to 1)
+GEOCODER_TIMEOUT = 10
+
+# A provider is skipped for BREAKER_COOLDOWN seconds after
+# BREAKER_THRESHOLD consecutive errors
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+# Cleaned addresses waiting for a geocoding worker, bounding memory use
+# on large files
+PIPELINE_QUEUE_SIZE = 200
+
+# Columns added to the uploaded CSV by process_csv
+RESULT_COLUMNS = ['latitude', 'longitude', 'full_address', 'match_level', 'confidence']
+
+# Geocoding results are kept in memory and persisted to SQLite across runs,
+# and looked up again after CACHE_TTL seconds
+CACHE_DB_PATH = os.environ.get("GEOCODE_CACHE_DB", "geocode_cache.sqlite3")
+CACHE_TTL = 86400
+MEMORY_CACHE_SIZE = 100_000
+
+# Pipeline marker for addresses rejected by is_geocodable
+_SKIPPED = object()
+
+# Common alternative spellings of country names found in addresses
+_COUNTRY_ALIASES = {
+    'AT': ['Österreich'],
+    'BR': ['Brasil'],
+    'CH': ['Schweiz', 'Suisse', 'Svizzera'],
+    'CN': ['中国'],
+    'DE': ['Deutschland'],
+    'ES': ['España', 'Espana'],
+    'GB': ['UK', 'Great Britain', 'Britain', 'England', 'Scotland', 'Wales'],
+    'IT': ['Italia'],
+    'JP': ['日本', 'Nippon'],
+    'KR': ['South Korea', 'Korea'],
+    'MX': ['México'],
+    'NL': ['Nederland', 'Holland'],
+    'RU': ['Russia'],
+    'US': ['USA', 'U.S.A.'],
+}
+
+# Placeholder values found in address columns that never geocode
+_PLACEHOLDER_ADDRESSES = {'n/a', 'nan', 'none', 'null', 'unknown', 'tbd'}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PUNCTUATION_RE = re.compile(r'[,.\-]')
+_CHINESE_RE = re.compile('[\u4e00-\u9fff]')
+
+# Streamlit re-executes main.py into a fresh module on every rerun, so
+# anything that must outlive a rerun (geocoders and their rate limiters,
+# breakers, the cache database, the country list) lives in st.cache_resource
+# or st.cache_data rather than in module-level variables.
+
+# Geocoders are created once and reused so their HTTP sessions keep
+# connections alive and rate limiting holds across worker threads and sessions
+@st.cache_resource
+def _nominatim_geocode():
+    return RateLimiter(
+        Nominatim(user_agent="my_geocoder_app", timeout=GEOCODER_TIMEOUT).geocode,
+        min_delay_seconds=NOMINATIM_MIN_DELAY,
+        max_retries=2,
+        error_wait_seconds=5,
+        swallow_exceptions=False
+    )
+
+class _Breaker:
+    """Circuit breaker tracking consecutive errors of one provider"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fails = 0
+        self.opened_at = None
+    
+    def is_open(self):
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                return True
+            # Cooldown over: let requests through again, but reopen on the
+            # next error
+            self.opened_at = None
+            self.fails = BREAKER_THRESHOLD - 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.fails = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        """Count an error, returning True if it just opened the breaker"""
+        with self._lock:
+            self.fails += 1
+            if self.fails >= BREAKER_THRESHOLD and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+@st.cache_resource
+def _get_breaker(provider, api_key=None):
+    # One per provider (and Google key), so a cooldown outlasts reruns
+    return _Breaker()
+
+@st.cache_resource(max_entries=4)
+def _google_geocode(api_key):
+    # No retries: a failed Google lookup falls back to Nominatim instead
+    return RateLimiter(
+        GoogleV3(api_key=api_key, timeout=GEOCODER_TIMEOUT).geocode,
+        min_delay_seconds=GOOGLE_MIN_DELAY,
+        max_retries=0,
+        swallow_exceptions=False
+    )
+
+class GeoResult(NamedTuple):
+    """Result of geocoding a single address"""
+    latitude: float
+    longitude: float
+    address: str
+    match_level: str
+    confidence: str
+    original_address: str
 
 def is_chinese(text):
     # Check if the text contains Chinese characters
     if text is None:
         return False
-    return bool(re.search('[\u4e00-\u9fff]', text))
+    # ASCII-only text (most addresses) cannot contain any; isascii() is a
+    # single C-level scan, much cheaper than running the regex
+    if text.isascii():
+        return False
+    return bool(_CHINESE_RE.search(text))
 
+@st.cache_data
 def get_country_list():
     # Get list of countries from pycountry
     countries = [(country.alpha_2, country.name) for country in pycountry.countries]
     countries.sort(key=lambda x: x[1])  # Sort by country name
     return countries
 
+# alpha_2 -> country name for the geocoders, and the selectbox options with the
+# global option at the top. Built once per rerun so format_func and the
+# geocoding workers do plain dict lookups
+_ALPHA2_TO_NAME = dict(get_country_list())
+_COUNTRY_LABELS = {'GLOBAL': 'Global (No country filter)', **_ALPHA2_TO_NAME}
+_COUNTRY_OPTIONS = list(_COUNTRY_LABELS)
+
 def clean_address(address):
     """Clean and standardize address"""
+    # Fold Unicode compatibility forms (fullwidth digits, decomposed accents)
+    # so equivalent spellings produce the same address; the quick check skips
+    # already-normalized input such as plain ASCII
+    if not unicodedata.is_normalized('NFKC', address):
+        address = unicodedata.normalize('NFKC', address)
+    
+    # Nothing to normalize: no punctuation and only single plain spaces
+    # (isprintable() is False for every whitespace character except ' ')
+    if (address.isprintable() and '  ' not in address
+            and ',' not in address and '.' not in address and '-' not in address):
+        return address.strip()
+    
     # Remove extra spaces and common punctuation
-    address = re.sub(r'\s+', ' ', address)
-    address = re.sub(r'[,.-]', ' ', address)
+    address = _WHITESPACE_RE.sub(' ', address)
+    address = _PUNCTUATION_RE.sub(' ', address)
     return address.strip()
 
+@st.cache_resource
+def _get_cache_db():
+    """Open the cache database once per server, with a lock guarding it"""
+    conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "key TEXT PRIMARY KEY, lat REAL, lon REAL, addr TEXT, "
+        "match_level TEXT, confidence TEXT, ts INTEGER)"
+    )
+    return conn, threading.Lock()
+
+def _cache_key(cleaned_location, country_code, match_level):
+    # The match level is part of the key so a Nominatim result never hides
+    # a Google one
+    return f"{match_level}|{country_code}|{cleaned_location.casefold()}"
+
+def _nominatim_cache_usable(cleaned_location, country_code, api_key):
+    # With a working Google key a Nominatim result only counts once Google is
+    # known to have no match; results stored after a Google error or before a
+    # key was entered are looked up again so they can be upgraded
+    if not api_key or _get_breaker('google', api_key).is_open():
+        return True
+    return _cache_get(_cache_key(cleaned_location, country_code, "GOOGLE_MISS")) is not None
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=MEMORY_CACHE_SIZE, show_spinner=False)
+def _cached_row(key):
+    """Look up a fresh geocoding result on disk, raising KeyError on a miss"""
+    # Misses raise instead of returning None so st.cache_data never
+    # remembers them
+    conn, lock = _get_cache_db()
+    with lock:
+        row = conn.execute(
+            "SELECT lat, lon, addr, match_level, confidence FROM cache "
+            "WHERE key = ? AND ts >= ?",
+            (key, int(time.time()) - CACHE_TTL)
+        ).fetchone()
+    if row is None:
+        raise KeyError(key)
+    return row
+
+def _cache_get(key):
+    try:
+        return _cached_row(key)
+    except KeyError:
+        return None
+
+def _store_result(key, result):
+    conn, lock = _get_cache_db()
+    with lock:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, result.latitude, result.longitude, result.address,
+             result.match_level, result.confidence, int(time.time()))
+        )
+        conn.commit()
+
+@functools.lru_cache(maxsize=None)
+def _country_spellings(country_code):
+    """Casefolded names and aliases of a country, space-padded for whole-word matching"""
+    country = pycountry.countries.get(alpha_2=country_code)
+    names = {country.name}
+    names.update(
+        name for name in (
+            getattr(country, 'official_name', None),
+            getattr(country, 'common_name', None)
+        ) if name
+    )
+    names.update(_COUNTRY_ALIASES.get(country_code, ()))
+    names = [clean_address(name).casefold() for name in names]
+    # CJK addresses are written without spaces ("中国北京市"), so those
+    # spellings match as plain substrings
+    return tuple(name if is_chinese(name) else f" {name} " for name in names)
+
+@functools.lru_cache(maxsize=260)
+def _country_codes(country_code):
+    # Nominatim's country filter, built once per country; a tuple is passed
+    # through by geopy as is and cannot be mutated by a caller
+    if not country_code or country_code == 'GLOBAL':
+        return None
+    return (country_code,)
+
+def _mentions_country(location, country_code):
+    # Only the selected country matters, so a few substring checks on the
+    # space-padded address are enough ("Niger" does not match "Nigeria")
+    padded = f" {location.casefold()} "
+    return any(name in padded for name in _country_spellings(country_code))
+
+def is_geocodable(address):
+    """Check whether a cleaned address could possibly match a location"""
+    # Rejects values like "N/A", "-" or bare numbers without a network call;
+    # the cheap length check runs first. It only applies to ASCII text, since
+    # CJK place names such as 北京 are two characters long
+    return (
+        (len(address) >= 3 or not address.isascii())
+        and address.casefold() not in _PLACEHOLDER_ADDRESSES
+        and any(c.isalpha() for c in address)
+    )
+
 def get_coordinates(location, country_code=None, api_key=None):
+    """Geocode an address, serving repeated addresses from the cache"""
+    return _geocode_cleaned(location, clean_address(location), country_code, api_key)
+
+def _geocode_cleaned(location, cleaned_location, country_code=None, api_key=None):
+    if not is_geocodable(cleaned_location):
+        return None
+    
+    row = _cache_get(_cache_key(cleaned_location, country_code, "GOOGLE_MATCH"))
+    if row is None and _nominatim_cache_usable(cleaned_location, country_code, api_key):
+        row = _cache_get(_cache_key(cleaned_location, country_code, "NOMINATIM_FULL"))
+    if row is not None:
+        return GeoResult(*row, original_address=location)
+    
+    result = _geocode_uncached(location, cleaned_location, country_code, api_key)
+    # Failed lookups are not cached so they are retried on the next run
+    if result is None:
+        return None
+    _store_result(_cache_key(cleaned_location, country_code, result.match_level), result)
+    return result
+
+def _geocode_uncached(original_location, location, country_code=None, api_key=None):
+    # location is the cleaned form of original_location
+    # Google's breaker is per key, so a bad key only affects its own lookups
+    google_breaker = _get_breaker('google', api_key) if api_key else None
+    nominatim_breaker = _get_breaker('nominatim')
     try:
-        original_location = location
-        location = clean_address(location)
-        
-        # Try Google Maps API first if API key is provided
-        if api_key:
-            geolocator = GoogleV3(api_key=api_key)
+        # Try Google Maps API first if API key is provided, unless it has
+        # been failing repeatedly (e.g. quota exhausted)
+        if api_key and not google_breaker.is_open():
+            miss_key = _cache_key(location, country_code, "GOOGLE_MISS")
             try:
                 # Add country bias if specified
                 if country_code and country_code != 'GLOBAL':
-                    country_name = pycountry.countries.get(alpha_2=country_code).name
-                    if country_name.lower() not in location.lower():
-                        location = f"{location}, {country_name}"
+                    if not _mentions_country(location, country_code):
+                        location = f"{location}, {_ALPHA2_TO_NAME[country_code]}"
                 
-                result = geolocator.geocode(
+                result = _google_geocode(api_key)(
                     location,
                     exactly_one=True
                 )
+                google_breaker.record_success()
                 
                 if result:
-                    return {
-                        'latitude': result.latitude,
-                        'longitude': result.longitude,
-                        'address': result.address,
-                        'match_level': "GOOGLE_MATCH",
-                        'confidence': "High",
-                        'original_address': original_location
-                    }
+                    return GeoResult(
+                        result.latitude,
+                        result.longitude,
+                        result.address,
+                        "GOOGLE_MATCH",
+                        "High",
+                        original_location
+                    )
+                # Remember that Google has no match so a cached Nominatim
+                # result is served next time without asking Google again
+                _store_result(miss_key, GeoResult(None, None, None, "GOOGLE_MISS", None, None))
             except Exception as e:
                 st.warning(f"Google Maps API error: {str(e)}, falling back to Nominatim")
+                if google_breaker.record_failure():
+                    st.warning(
+                        f"Google Maps API failed {BREAKER_THRESHOLD} times in a row, "
+                        f"using Nominatim only for the next {BREAKER_COOLDOWN} seconds"
+                    )
         
         # Fall back to Nominatim if Google fails or no API key
-        geolocator = Nominatim(user_agent="my_geocoder_app")
-        
         # Try with full address first
         if country_code and country_code != 'GLOBAL':
-            country_name = pycountry.countries.get(alpha_2=country_code).name
+            country_name = _ALPHA2_TO_NAME[country_code]
             search_location = f"{location}, {country_name}"
         else:
             search_location = location
-            
-        result = geolocator.geocode(
-            search_location,
-            exactly_one=True,
-            language='en',
-            country_codes=None if country_code == 'GLOBAL' else [country_code]
-        )
+        
+        if nominatim_breaker.is_open():
+            return None
+        
+        try:
+            result = _nominatim_geocode()(
+                search_location,
+                exactly_one=True,
+                language='en',
+                country_codes=_country_codes(country_code)
+            )
+        except Exception:
+            if nominatim_breaker.record_failure():
+                st.warning(
+                    f"Nominatim failed {BREAKER_THRESHOLD} times in a row, "
+                    f"addresses are left blank for the next {BREAKER_COOLDOWN} seconds"
+                )
+            raise
+        nominatim_breaker.record_success()
         
         if result:
-            formatted_address = result.address.replace(", ", "\n")
-            return {
-                'latitude': result.latitude,
-                'longitude': result.longitude,
-                'address': formatted_address,
-                'match_level': "NOMINATIM_FULL",
-                'confidence': "Medium",
-                'original_address': original_location
-            }
+            return GeoResult(
+                result.latitude,
+                result.longitude,
+                result.address,
+                "NOMINATIM_FULL",
+                "Medium",
+                original_location
+            )
             
         return None
             
@@ -93,53 +403,196 @@ def get_coordinates(location, country_code=None, api_key=None):
         st.error(f"Error processing address: {str(e)}")
         return None
 
-def process_csv(df, address_column, country_code, api_key=None):
-    # Add new columns for results
-    df['latitude'] = None
-    df['longitude'] = None
-    df['full_address'] = None
-    df['match_level'] = None
-    df['confidence'] = None
+def _put_unless_stopped(q, item, stop):
+    # Bounded put that gives up once the pipeline has been stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _clean_addresses(addresses, q_in, q_out, workers, stop):
+    """Producer stage: clean addresses ahead of the geocoding workers"""
+    for address in addresses:
+        cleaned = clean_address(address)
+        if is_geocodable(cleaned):
+            if not _put_unless_stopped(q_in, (address, cleaned), stop):
+                return
+        else:
+            # Addresses that can never match skip the network entirely
+            q_out.put((address, _SKIPPED))
+    # One stop signal per worker
+    for _ in range(workers):
+        _put_unless_stopped(q_in, None, stop)
+
+def _geocode_worker(q_in, q_out, country_code, api_key, stop):
+    """Consumer stage: geocode cleaned addresses until told to stop"""
+    while not stop.is_set():
+        try:
+            item = q_in.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        # The pipeline may have been stopped while this worker was waiting
+        if item is None or stop.is_set():
+            return
+        address, cleaned = item
+        try:
+            result = _geocode_cleaned(address, cleaned, country_code, api_key)
+        except Exception as e:
+            # Hand the error to the main thread instead of losing the address
+            result = e
+        q_out.put((address, result))
+
+def _geocode_all(addresses, country_code, api_key):
+    """Geocode addresses in a clean -> geocode pipeline, yielding (address, result) as they complete"""
+    # Lookups are network-bound, so worker threads overlap the waits while
+    # the producer cleans the next addresses; provider pacing is handled by
+    # the rate limiters inside each lookup
+    workers = GOOGLE_CONCURRENCY if api_key else NOMINATIM_CONCURRENCY
+    q_in = queue.Queue(PIPELINE_QUEUE_SIZE)
+    q_out = queue.Queue()
+    stop = threading.Event()
+    
+    threads = [threading.Thread(
+        target=_clean_addresses, args=(addresses, q_in, q_out, workers, stop), daemon=True
+    )]
+    threads += [
+        threading.Thread(
+            target=_geocode_worker,
+            args=(q_in, q_out, country_code, api_key, stop),
+            daemon=True
+        )
+        for _ in range(workers)
+    ]
     
+    # Worker threads need the script context so st.warning/st.error still render
+    ctx = get_script_run_ctx()
+    for thread in threads:
+        add_script_run_ctx(thread, ctx)
+        thread.start()
+    
+    try:
+        for _ in range(len(addresses)):
+            address, result = q_out.get()
+            if isinstance(result, Exception):
+                raise result
+            yield address, result
+    finally:
+        # Runs on completion, on errors and when the caller abandons the
+        # generator, e.g. when Streamlit interrupts the script for a rerun;
+        # without it the threads would geocode every remaining address
+        stop.set()
+        # Discard queued addresses so none of them reaches a provider
+        while True:
+            try:
+                q_in.get_nowait()
+            except queue.Empty:
+                break
+
+def _collect_results(addresses, country_code, api_key, progress_bar, status_text):
+    results = {}
+    skipped = set()
+    total = len(addresses)
+    # Each update is a message to the browser, so report about 100 times
+    # per run rather than once per address
+    report_every = max(1, total // 100)
+    # closing() stops the pipeline as soon as this loop is left, including
+    # by an exception
+    with closing(_geocode_all(addresses, country_code, api_key)) as pipeline:
+        for done, (address, result) in enumerate(pipeline, start=1):
+            if result is _SKIPPED:
+                skipped.add(address)
+            elif result:
+                results[address] = result
+            
+            # Update progress bar
+            if done % report_every == 0 or done == total:
+                status_text.text(f"Processing address {done}/{total}")
+                progress_bar.progress(done / total)
+    return results, skipped
+
+def _flatten(result):
+    # Turn a geocoding result into a row of RESULT_COLUMNS values; they are
+    # the leading GeoResult fields in the same order
+    if not result:
+        return (None, None, None, None, None)
+    return result[:5]
+
+def process_csv(df, address_column, country_code, api_key=None):
     # Create a progress bar
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    # Process each address
-    total_rows = len(df)
-    for index, row in df.iterrows():
-        status_text.text(f"Processing row {index + 1}/{total_rows}")
-        
-        # Skip empty addresses
-        if pd.isna(row[address_column]) or str(row[address_column]).strip() == '':
-            continue
-            
-        result = get_coordinates(str(row[address_column]), country_code, api_key)
-        if result:
-            df.at[index, 'latitude'] = result['latitude']
-            df.at[index, 'longitude'] = result['longitude']
-            df.at[index, 'full_address'] = result['address']
-            df.at[index, 'match_level'] = result['match_level']
-            df.at[index, 'confidence'] = result['confidence']
-        
-        # Update progress bar
-        progress_bar.progress((index + 1) / total_rows)
-        
-        # Add a small delay to avoid hitting API limits
-        time.sleep(1)
+    # A cooldown started by an earlier run still applies to this one
+    if _get_breaker('nominatim').is_open():
+        st.warning(
+            "Nominatim is paused after repeated errors, addresses it would "
+            "look up are left blank until it recovers"
+        )
+    
+    # Skip empty addresses, using one vectorized mask instead of per-row checks
+    stripped = df[address_column].astype('string').str.strip()
+    addresses = stripped[stripped.notna() & stripped.ne('')]
+    
+    # Geocode each distinct address once, concurrently
+    unique_addresses = addresses.unique().tolist()
+    results, skipped = _collect_results(
+        unique_addresses, country_code, api_key, progress_bar, status_text
+    )
+    st.sidebar.metric(
+        "Ungeocodable rows skipped", int(addresses.isin(list(skipped)).sum())
+    )
+    
+    # Build one row of results per unique address, then join it onto every
+    # row sharing that address with a single hash lookup
+    results_df = pd.DataFrame(
+        [_flatten(results.get(address)) for address in unique_addresses],
+        index=unique_addresses,
+        columns=RESULT_COLUMNS
+    ).astype({'latitude': 'Float64', 'longitude': 'Float64'})
+    joined = results_df.reindex(addresses)
+    joined.index = addresses.index
+    df[RESULT_COLUMNS] = joined
     
     status_text.text("Processing complete!")
     return df
 
+def export_csv(df):
+    """Write results to a temporary CSV file and return its path
+
+    Values are written as pandas' to_csv writes them, except that Arrow
+    quotes every text field and writes whole floats without a trailing ".0".
+    """
+    # Arrow writes booleans as true/false and empty strings as "", and cannot
+    # convert object columns mixing types, so render those columns as text
+    # the way pandas does, with empty strings left blank
+    text_columns = {
+        column: df[column].astype('string').replace('', pd.NA)
+        for column in df.columns
+        if is_bool_dtype(df[column]) or is_object_dtype(df[column])
+        or is_string_dtype(df[column])
+    }
+    
+    with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as tmp:
+        try:
+            # Arrow's C++ CSV writer encodes columns natively and writes
+            # straight to the file
+            table = pa.Table.from_pandas(df.assign(**text_columns), preserve_index=False)
+            pa_csv.write_csv(
+                table, tmp, write_options=pa_csv.WriteOptions(quoting_style='needed')
+            )
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name
+
 def main():
     st.title("Advanced Address Geocoding App")
     st.write("Convert addresses to latitude and longitude coordinates worldwide")
     
-    # Get list of countries
-    countries = get_country_list()
-    # Add global option at the top
-    country_options = [('GLOBAL', 'Global (No country filter)')] + countries
-    
     # API Key input in sidebar
     api_key = st.sidebar.text_input(
         "Enter Google Maps API Key (optional):",
@@ -157,8 +610,8 @@ def main():
         # Country selection
         selected_country = st.selectbox(
             "Select country (or Global for no filter):",
-            options=[code for code, name in country_options],
-            format_func=lambda x: dict(country_options)[x],
+            options=_COUNTRY_OPTIONS,
+            format_func=_COUNTRY_LABELS.__getitem__,
             index=0
         )
         
@@ -173,16 +626,21 @@ def main():
                     st.success("Location found!")
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Latitude", f"{result['latitude']:.6f}")
+                        st.metric("Latitude", f"{result.latitude:.6f}")
                     with col2:
-                        st.metric("Longitude", f"{result['longitude']:.6f}")
+                        st.metric("Longitude", f"{result.longitude:.6f}")
                     with col3:
-                        st.metric("Confidence", result['confidence'])
+                        st.metric("Confidence", result.confidence)
                     st.write("**Original Address:**")
-                    st.text(result['original_address'])
+                    st.text(result.original_address)
                     st.write("**Matched Address:**")
-                    st.text(result['address'])
-                    st.write(f"**Match Level:** {result['match_level']}")
+                    if result.match_level == "NOMINATIM_FULL":
+                        # Nominatim's display_name is one long comma-separated
+                        # string, so show one component per line
+                        st.text(result.address.replace(", ", "\n"))
+                    else:
+                        st.text(result.address)
+                    st.write(f"**Match Level:** {result.match_level}")
                 else:
                     st.error("Could not find location. Please try a different address.")
     
@@ -194,8 +652,8 @@ def main():
         # Country selection for CSV processing
         selected_country_csv = st.selectbox(
             "Select country for CSV processing (or Global for no filter):",
-            options=[code for code, name in country_options],
-            format_func=lambda x: dict(country_options)[x],
+            options=_COUNTRY_OPTIONS,
+            format_func=_COUNTRY_LABELS.__getitem__,
             index=0,
             key="csv_country"
         )
@@ -218,7 +676,9 @@ def main():
             
             if st.button("Process CSV"):
                 with st.spinner("Processing addresses..."):
-                    result_df = process_csv(df.copy(), address_column, selected_country_csv, api_key)
+                    # df is re-read from the upload on every rerun, so it can be
+                    # filled in place instead of copied
+                    result_df = process_csv(df, address_column, selected_country_csv, api_key)
                     
                     # Create download button for results
                     st.success("Processing complete! You can now download the results.")
@@ -227,14 +687,18 @@ def main():
                     st.write("Preview of results:")
                     st.dataframe(result_df.head())
                     
-                    # Convert dataframe to CSV for download
-                    csv = result_df.to_csv(index=False)
-                    st.download_button(
-                        label="Download Results",
-                        data=csv,
-                        file_name="geocoded_results.csv",
-                        mime="text/csv"
-                    )
+                    # Stream the CSV through a temporary file for download
+                    csv_path = export_csv(result_df)
+                    try:
+                        with open(csv_path, 'rb') as csv_file:
+                            st.download_button(
+                                label="Download Results",
+                                data=csv_file,
+                                file_name="geocoded_results.csv",
+                                mime="text/csv"
+                            )
+                    finally:
+                        os.remove(csv_path)
 
 if __name__ == "__main__":
     main()